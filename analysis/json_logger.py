@@ -1,19 +1,33 @@
 import json
 from mitmproxy import ctx
 
+# Kept open for the lifetime of the addon instead of reopening per record
+_LOG = open("ha_traffic.jsonl", "a")
+
+def _headers(headers):
+    # Single pass over the raw fields; dict(headers) rescans all fields for
+    # every key. Repeated headers are joined with ", " as Headers does.
+    out = {}
+    names = {}
+    for name, value in headers.fields:
+        key = names.setdefault(name.lower(), name.decode("utf-8", "surrogateescape"))
+        value = value.decode("utf-8", "surrogateescape")
+        out[key] = out[key] + ", " + value if key in out else value
+    return out
+
 def response(flow):
     record = {
         "timestamp": flow.request.timestamp_start,
         "method": flow.request.method,
         "url": flow.request.pretty_url,
-        "request_headers": dict(flow.request.headers),
+        "request_headers": _headers(flow.request.headers),
         "request_body": flow.request.text if flow.request.text else None,
         "status_code": flow.response.status_code,
-        "response_headers": dict(flow.response.headers),
+        "response_headers": _headers(flow.response.headers),
         "response_body": flow.response.text if flow.response.text else None,
     }
-    with open("ha_traffic.jsonl", "a") as f:
-        f.write(json.dumps(record) + "\n")
+    _LOG.write(json.dumps(record) + "\n")
+    _LOG.flush()
 
 def websocket_message(flow):
     msg = flow.websocket.messages[-1]
@@ -24,5 +38,8 @@ def websocket_message(flow):
         "direction": "client" if msg.from_client else "server",
         "content": msg.text if msg.is_text else "<binary>",
     }
-    with open("ha_traffic.jsonl", "a") as f:
-        f.write(json.dumps(record) + "\n")
\ No newline at end of file
+    _LOG.write(json.dumps(record) + "\n")
+    _LOG.flush()
+
+def done():
+    _LOG.close()
\ No newline at end of file
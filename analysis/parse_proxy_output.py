@@ -7,21 +7,63 @@
 # It's also finding unique websocket messages sent to the server and responses received.
 # Matching requests and responses based on flow IDs (.id field in the messages)
 
+import io
 import json
+import os
+import re
 import sys
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 INPUT_FILE = "../tmp/ha_traffic.jsonl"
 OUTPUT_FILE = "../tmp/parsed_proxy_output.txt"
 
+# Minimum number of input bytes handed to each worker process
+MIN_CHUNK_SIZE = 8 * 1024 * 1024
+
+_SENSITIVE_HEADERS = frozenset({"authorization", "cookie", "set-cookie", "x-api-key"})
+# Sensitive header names keyed by the code point of their lowercase first letter
+_SENSITIVE_HEADERS_BY_FIRST = {
+    ord(first): frozenset(k for k in _SENSITIVE_HEADERS if k[0] == first)
+    for first in {k[0] for k in _SENSITIVE_HEADERS}
+}
+
+# Tokens that look like JWTs (header.payload.signature)
+_JWT_RE = re.compile(r'eyJ[A-Za-z0-9_-]*\.eyJ[A-Za-z0-9_-]*\.[A-Za-z0-9_-]*')
+# Refresh tokens (long hex strings, typically 64+ chars)
+_REFRESH_RE = re.compile(r'refresh_token["\s:=]+([a-f0-9]{64,})', re.IGNORECASE)
+# Access tokens in JSON
+_ACCESS_RE = re.compile(r'"access_token"\s*:\s*"[^"]*"')
+
+
+if orjson is not None:
+    _loads = orjson.loads
+
+    def _dumps(obj, indent=None) -> str:
+        # orjson only supports 2-space indentation
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0).decode()
+else:
+    _loads = json.loads
+
+    def _dumps(obj, indent=None) -> str:
+        return json.dumps(obj, indent=indent, ensure_ascii=False)
+
 
 def mask_sensitive_headers(headers: dict) -> dict:
     """Mask sensitive header values like Authorization."""
     masked = {}
-    sensitive_keys = {"authorization", "cookie", "set-cookie", "x-api-key"}
     for key, value in headers.items():
-        if key.lower() in sensitive_keys:
+        # Setting bit 0x20 lowercases an ASCII letter, so most names are
+        # rejected by one lookup without lowercasing the whole string
+        candidates = _SENSITIVE_HEADERS_BY_FIRST.get(ord(key[0]) | 0x20) if key else None
+        if candidates is not None and key.lower() in candidates:
             masked[key] = "***MASKED***"
         else:
             masked[key] = value
@@ -33,29 +75,14 @@ def mask_sensitive_body(body: str) -> str:
     if not body:
         return body
 
-    import re
-
-    # Mask tokens that look like JWTs (header.payload.signature)
-    body = re.sub(
-        r'eyJ[A-Za-z0-9_-]*\.eyJ[A-Za-z0-9_-]*\.[A-Za-z0-9_-]*',
-        '***JWT_TOKEN***',
-        body
-    )
-
-    # Mask refresh tokens (long hex strings, typically 64+ chars)
-    body = re.sub(
-        r'refresh_token["\s:=]+([a-f0-9]{64,})',
-        r'refresh_token": "***MASKED_REFRESH_TOKEN***',
-        body,
-        flags=re.IGNORECASE
-    )
-
-    # Mask access tokens in JSON
-    body = re.sub(
-        r'"access_token"\s*:\s*"[^"]*"',
-        '"access_token": "***MASKED***"',
-        body
-    )
+    # Most bodies contain none of the markers, skip the regex for those.
+    # The refresh token pattern is case-insensitive, hence the casefold().
+    if "eyJ" not in body and "access_token" not in body and "refresh_token" not in body.casefold():
+        return body
+
+    body = _JWT_RE.sub('***JWT_TOKEN***', body)
+    body = _REFRESH_RE.sub(r'refresh_token": "***MASKED_REFRESH_TOKEN***', body)
+    body = _ACCESS_RE.sub('"access_token": "***MASKED***"', body)
 
     return body
 
@@ -65,7 +92,7 @@ def parse_ws_content(content: str) -> dict | None:
     if not content or content == "<binary>":
         return None
     try:
-        return json.loads(content)
+        return _loads(content)
     except json.JSONDecodeError:
         return None
 
@@ -74,7 +101,7 @@ def format_json(obj, indent=2, max_length=500, mask_secrets=False) -> str:
     """Format JSON object, truncating if too long."""
     if obj is None:
         return "null"
-    formatted = json.dumps(obj, indent=indent, ensure_ascii=False)
+    formatted = _dumps(obj, indent=indent)
     if mask_secrets:
         formatted = mask_sensitive_body(formatted)
     if len(formatted) > max_length:
@@ -82,41 +109,81 @@ def format_json(obj, indent=2, max_length=500, mask_secrets=False) -> str:
     return formatted
 
 
-def main():
-    input_path = Path(__file__).parent / INPUT_FILE
-    output_path = Path(__file__).parent / OUTPUT_FILE
+def parse_body(body: str | None):
+    """Parse a request/response body as JSON, returning None if it is not JSON."""
+    if not body:
+        return None
+    try:
+        return _loads(body)
+    except ValueError:
+        return None
 
-    if not input_path.exists():
-        print(f"Error: Input file not found: {input_path}")
-        sys.exit(1)
 
-    # Data structures for collecting information
-    http_endpoints = defaultdict(lambda: {
-        "methods": set(),
-        "requests": [],
-        "responses": []
-    })
+def request_signature(method: str, body: str | None) -> tuple[str, str]:
+    """Signature used to keep only unique requests per endpoint.
+
+    The tuple references the method and body strings that are stored with the
+    request anyway, rather than copying the body into a new string.
+    """
+    return method, body or ""
+
+
+# Unique examples of each endpoint are stored as parallel lists, one per field
+EXAMPLE_FIELDS = (
+    "req_methods", "req_headers", "req_bodies",
+    "resp_statuses", "resp_headers", "resp_bodies",
+)
+
+
+def new_endpoint() -> dict:
+    """Empty collection of methods and unique examples for an HTTP endpoint."""
+    endpoint = {"methods": set(), "sigs": set()}
+    for field in EXAMPLE_FIELDS:
+        endpoint[field] = []
+    return endpoint
+
+
+def parse_chunk(input_path: Path, start: int, end: int) -> dict:
+    """Parse the lines starting within the byte range [start, end) of the JSONL file.
+
+    Runs in a worker process. Line numbers in the returned warnings are
+    relative to the first line of the chunk.
+    """
+    http_endpoints = defaultdict(new_endpoint)
 
     ws_message_types = defaultdict(lambda: {
         "samples": [],
+        "remaining": 3,  # samples still to collect
         "count": 0
     })
 
     ws_requests = {}  # id -> request message
-    ws_responses = {}  # id -> response message
-    ws_matched_pairs = []  # (request, response) pairs
-
-    # Parse the JSONL file
-    with open(input_path, "r") as f:
-        for line_num, line in enumerate(f, 1):
-            line = line.strip()
+    ws_pairs = []  # (id, request or None if not in this chunk, response)
+    warnings = []  # (line number, error)
+    line_num = 0
+
+    with open(input_path, "rb", buffering=1 << 20) as f:
+        # Skip the line straddling the start, it belongs to the previous chunk
+        if start:
+            f.seek(start - 1)
+            f.readline()
+        pos = f.tell()
+
+        while pos < end:
+            line = f.readline()
             if not line:
+                break
+            pos += len(line)
+            line_num += 1
+
+            # Both JSON parsers accept the bytes as-is, trailing newline included
+            if line.isspace():
                 continue
 
             try:
-                record = json.loads(line)
+                record = _loads(line)
             except json.JSONDecodeError as e:
-                print(f"Warning: Failed to parse line {line_num}: {e}")
+                warnings.append((line_num, str(e)))
                 continue
 
             if record.get("type") == "websocket":
@@ -129,136 +196,189 @@ def main():
                     msg_id = content.get("id")
 
                     # Track message types
-                    ws_message_types[msg_type]["count"] += 1
-                    if len(ws_message_types[msg_type]["samples"]) < 3:
-                        ws_message_types[msg_type]["samples"].append(content)
+                    type_info = ws_message_types[msg_type]
+                    type_info["count"] += 1
+                    if type_info["remaining"]:
+                        type_info["samples"].append(content)
+                        type_info["remaining"] -= 1
 
                     # Track request/response pairs by ID
                     if msg_id is not None:
                         if direction == "client":
                             ws_requests[msg_id] = content
                         else:
-                            ws_responses[msg_id] = content
-                            # Try to match with request
-                            if msg_id in ws_requests:
-                                ws_matched_pairs.append((ws_requests[msg_id], content))
+                            # Try to match with request, which may be in an earlier chunk
+                            ws_pairs.append((msg_id, ws_requests.get(msg_id), content))
             else:
                 # HTTP request/response
                 url = record.get("url", "")
                 method = record.get("method", "")
 
-                # Extract path from URL (remove host)
-                if "://" in url:
-                    path = "/" + url.split("://", 1)[1].split("/", 1)[-1]
+                # Extract path from URL (remove host), keeping the query string
+                scheme_end = url.find("://")
+                if scheme_end >= 0:
+                    path_start = url.find("/", scheme_end + 3)
+                    path = url[path_start:] if path_start >= 0 else "/" + url[scheme_end + 3:]
                 else:
                     path = url
 
-                http_endpoints[path]["methods"].add(method)
+                info = http_endpoints[path]
+                info["methods"].add(method)
 
-                # Store request details
-                request_info = {
-                    "method": method,
-                    "headers": mask_sensitive_headers(record.get("request_headers", {})),
-                    "body": record.get("request_body")
-                }
+                # Keep only unique request/response combinations (first occurrence)
+                req_body = record.get("request_body")
+                req_sig = request_signature(method, req_body)
+                if req_sig not in info["sigs"]:
+                    info["sigs"].add(req_sig)
+                    resp_body = record.get("response_body")
+                    info["req_methods"].append(method)
+                    info["req_headers"].append(mask_sensitive_headers(record.get("request_headers", {})))
+                    info["req_bodies"].append(req_body)
+                    info["resp_statuses"].append(record.get("status_code"))
+                    info["resp_headers"].append(mask_sensitive_headers(record.get("response_headers", {})))
+                    info["resp_bodies"].append(resp_body)
+
+    # The parent rebuilds the signatures while merging, don't send them back
+    for info in http_endpoints.values():
+        del info["sigs"]
 
-                response_info = {
-                    "status_code": record.get("status_code"),
-                    "headers": mask_sensitive_headers(record.get("response_headers", {})),
-                    "body": record.get("response_body")
-                }
+    return {
+        "lines": line_num,
+        "warnings": warnings,
+        "http_endpoints": dict(http_endpoints),
+        "ws_message_types": dict(ws_message_types),
+        "ws_pairs": ws_pairs,
+        "ws_requests": ws_requests,
+    }
 
-                # Keep only unique request/response combinations (first occurrence)
-                req_sig = f"{method}:{json.dumps(request_info['body'], sort_keys=True) if request_info['body'] else ''}"
-                existing_sigs = [f"{r['method']}:{json.dumps(r['body'], sort_keys=True) if r['body'] else ''}"
-                                for r in http_endpoints[path]["requests"]]
 
-                if req_sig not in existing_sigs:
-                    http_endpoints[path]["requests"].append(request_info)
-                    http_endpoints[path]["responses"].append(response_info)
+def main():
+    input_path = Path(__file__).parent / INPUT_FILE
+    output_path = Path(__file__).parent / OUTPUT_FILE
+
+    if not input_path.exists():
+        print(f"Error: Input file not found: {input_path}")
+        sys.exit(1)
+
+    # Split the file into newline-aligned byte ranges, one per worker
+    size = os.path.getsize(input_path)
+    workers = max(1, min(os.cpu_count() or 1, size // MIN_CHUNK_SIZE))
+    bounds = [size * i // workers for i in range(workers + 1)]
+    if workers == 1:
+        chunks = [parse_chunk(input_path, 0, size)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunks = list(pool.map(parse_chunk, repeat(input_path), bounds[:-1], bounds[1:]))
+
+    # Data structures for collecting information
+    http_endpoints = defaultdict(new_endpoint)
+
+    ws_message_types = defaultdict(lambda: {
+        "samples": [],
+        "remaining": 3,  # samples still to collect
+        "count": 0
+    })
+
+    ws_requests = {}  # id -> request message
+    ws_matched_pairs = []  # (request, response) pairs
+
+    # Merge the chunks in file order so that "first occurrence" still refers
+    # to the whole file
+    line_offset = 0
+    for chunk in chunks:
+        for line_num, error in chunk["warnings"]:
+            print(f"Warning: Failed to parse line {line_offset + line_num}: {error}")
+        line_offset += chunk["lines"]
+
+        for path, chunk_info in chunk["http_endpoints"].items():
+            info = http_endpoints[path]
+            info["methods"] |= chunk_info["methods"]
+            for i, (method, body) in enumerate(zip(chunk_info["req_methods"], chunk_info["req_bodies"])):
+                req_sig = request_signature(method, body)
+                if req_sig not in info["sigs"]:
+                    info["sigs"].add(req_sig)
+                    for field in EXAMPLE_FIELDS:
+                        info[field].append(chunk_info[field][i])
+
+        for msg_type, chunk_info in chunk["ws_message_types"].items():
+            info = ws_message_types[msg_type]
+            info["count"] += chunk_info["count"]
+            if info["remaining"]:
+                samples = chunk_info["samples"][:info["remaining"]]
+                info["samples"].extend(samples)
+                info["remaining"] -= len(samples)
+
+        # Responses whose request was not in the same chunk are matched
+        # against the requests seen in earlier chunks
+        for msg_id, request, response in chunk["ws_pairs"]:
+            if request is None:
+                request = ws_requests.get(msg_id)
+                if request is None:
+                    continue
+            ws_matched_pairs.append((request, response))
+        ws_requests.update(chunk["ws_requests"])
 
     # Generate output
-    output_lines = []
+    http_paths_sorted = sorted(http_endpoints)
+    ws_types_sorted = sorted(ws_message_types)
+    buf = io.StringIO()
+    w = buf.write
 
     # Section 1: HTTP Endpoints
-    output_lines.append("=" * 80)
-    output_lines.append("HTTP ENDPOINTS")
-    output_lines.append("=" * 80)
-    output_lines.append("")
+    w(f"{'=' * 80}\nHTTP ENDPOINTS\n{'=' * 80}\n\n")
 
-    for path in sorted(http_endpoints.keys()):
+    for path in http_paths_sorted:
         info = http_endpoints[path]
         methods = ", ".join(sorted(info["methods"]))
-        output_lines.append(f"### {methods} {path}")
-        output_lines.append("")
-
-        for i, (req, resp) in enumerate(zip(info["requests"], info["responses"])):
-            if len(info["requests"]) > 1:
-                output_lines.append(f"**Example {i + 1}:**")
-
-            output_lines.append(f"**Request Headers:**")
-            output_lines.append("```json")
-            output_lines.append(format_json(req["headers"]))
-            output_lines.append("```")
-
-            if req["body"]:
-                output_lines.append(f"**Request Body:**")
-                output_lines.append("```json")
-                masked_body = mask_sensitive_body(req["body"])
-                try:
-                    body = json.loads(masked_body)
-                    output_lines.append(format_json(body, max_length=1000))
-                except:
-                    output_lines.append(masked_body[:1000])
-                output_lines.append("```")
-
-            output_lines.append(f"**Response Status:** {resp['status_code']}")
-
-            if resp["body"]:
-                output_lines.append(f"**Response Body:**")
-                output_lines.append("```json")
-                masked_body = mask_sensitive_body(resp["body"])
-                try:
-                    body = json.loads(masked_body)
-                    output_lines.append(format_json(body, max_length=1000))
-                except:
-                    output_lines.append(masked_body[:1000])
-                output_lines.append("```")
-
-            output_lines.append("")
-
-        output_lines.append("-" * 40)
-        output_lines.append("")
+        w(f"### {methods} {path}\n\n")
+
+        examples = len(info["req_methods"])
+        for i in range(examples):
+            if examples > 1:
+                w(f"**Example {i + 1}:**\n")
+
+            w(f"**Request Headers:**\n```json\n{format_json(info['req_headers'][i])}\n```\n")
+
+            req_body = info["req_bodies"][i]
+            if req_body:
+                parsed = parse_body(req_body)
+                if parsed is not None:
+                    body = format_json(parsed, max_length=1000, mask_secrets=True)
+                else:
+                    body = mask_sensitive_body(req_body)[:1000]
+                w(f"**Request Body:**\n```json\n{body}\n```\n")
+
+            w(f"**Response Status:** {info['resp_statuses'][i]}\n")
+
+            resp_body = info["resp_bodies"][i]
+            if resp_body:
+                parsed = parse_body(resp_body)
+                if parsed is not None:
+                    body = format_json(parsed, max_length=1000, mask_secrets=True)
+                else:
+                    body = mask_sensitive_body(resp_body)[:1000]
+                w(f"**Response Body:**\n```json\n{body}\n```\n")
+
+            w("\n")
+
+        w(f"{'-' * 40}\n\n")
 
     # Section 2: WebSocket Message Types
-    output_lines.append("")
-    output_lines.append("=" * 80)
-    output_lines.append("WEBSOCKET MESSAGE TYPES")
-    output_lines.append("=" * 80)
-    output_lines.append("")
+    w(f"\n{'=' * 80}\nWEBSOCKET MESSAGE TYPES\n{'=' * 80}\n\n")
 
-    for msg_type in sorted(ws_message_types.keys()):
+    for msg_type in ws_types_sorted:
         info = ws_message_types[msg_type]
-        output_lines.append(f"### {msg_type} (count: {info['count']})")
-        output_lines.append("")
+        w(f"### {msg_type} (count: {info['count']})\n\n")
 
         for i, sample in enumerate(info["samples"]):
             if len(info["samples"]) > 1:
-                output_lines.append(f"**Sample {i + 1}:**")
-            output_lines.append("```json")
-            output_lines.append(format_json(sample, max_length=800, mask_secrets=True))
-            output_lines.append("```")
-            output_lines.append("")
+                w(f"**Sample {i + 1}:**\n")
+            w(f"```json\n{format_json(sample, max_length=800, mask_secrets=True)}\n```\n\n")
 
-        output_lines.append("-" * 40)
-        output_lines.append("")
+        w(f"{'-' * 40}\n\n")
 
     # Section 3: WebSocket Request/Response Pairs
-    output_lines.append("")
-    output_lines.append("=" * 80)
-    output_lines.append("WEBSOCKET REQUEST/RESPONSE PAIRS")
-    output_lines.append("=" * 80)
-    output_lines.append("")
+    w(f"\n{'=' * 80}\nWEBSOCKET REQUEST/RESPONSE PAIRS\n{'=' * 80}\n\n")
 
     # Group pairs by request type
     pairs_by_type = defaultdict(list)
@@ -266,68 +386,52 @@ def main():
         req_type = req.get("type", "unknown")
         pairs_by_type[req_type].append((req, resp))
 
-    for req_type in sorted(pairs_by_type.keys()):
+    for req_type in sorted(pairs_by_type):
         pairs = pairs_by_type[req_type]
-        output_lines.append(f"### {req_type} ({len(pairs)} occurrences)")
-        output_lines.append("")
+        w(f"### {req_type} ({len(pairs)} occurrences)\n\n")
 
         # Show up to 2 examples per type
         for i, (req, resp) in enumerate(pairs[:2]):
             if len(pairs) > 1:
-                output_lines.append(f"**Example {i + 1}:**")
+                w(f"**Example {i + 1}:**\n")
 
-            output_lines.append("**Request:**")
-            output_lines.append("```json")
-            output_lines.append(format_json(req, max_length=600, mask_secrets=True))
-            output_lines.append("```")
+            w(f"**Request:**\n```json\n{format_json(req, max_length=600, mask_secrets=True)}\n```\n")
+            w(f"**Response:**\n```json\n{format_json(resp, max_length=600, mask_secrets=True)}\n```\n\n")
 
-            output_lines.append("**Response:**")
-            output_lines.append("```json")
-            output_lines.append(format_json(resp, max_length=600, mask_secrets=True))
-            output_lines.append("```")
-            output_lines.append("")
-
-        output_lines.append("-" * 40)
-        output_lines.append("")
+        w(f"{'-' * 40}\n\n")
 
     # Section 4: Summary Statistics
-    output_lines.append("")
-    output_lines.append("=" * 80)
-    output_lines.append("SUMMARY")
-    output_lines.append("=" * 80)
-    output_lines.append("")
-    output_lines.append(f"Total unique HTTP endpoints: {len(http_endpoints)}")
-    output_lines.append(f"Total unique WebSocket message types: {len(ws_message_types)}")
-    output_lines.append(f"Total matched WebSocket request/response pairs: {len(ws_matched_pairs)}")
-    output_lines.append("")
-
-    output_lines.append("**HTTP Endpoints by Method:**")
+    w(f"\n{'=' * 80}\nSUMMARY\n{'=' * 80}\n\n"
+      f"Total unique HTTP endpoints: {len(http_endpoints)}\n"
+      f"Total unique WebSocket message types: {len(ws_message_types)}\n"
+      f"Total matched WebSocket request/response pairs: {len(ws_matched_pairs)}\n\n")
+
+    w("**HTTP Endpoints by Method:**\n")
     method_counts = defaultdict(int)
     for info in http_endpoints.values():
         for method in info["methods"]:
             method_counts[method] += 1
     for method, count in sorted(method_counts.items()):
-        output_lines.append(f"  {method}: {count}")
-    output_lines.append("")
+        w(f"  {method}: {count}\n")
+    w("\n")
 
-    output_lines.append("**WebSocket Message Types (client -> server):**")
-    client_types = [t for t, info in ws_message_types.items()
-                    if any(s.get("id") for s in info["samples"])]
-    for msg_type in sorted(client_types):
-        output_lines.append(f"  - {msg_type}")
-    output_lines.append("")
+    w("**WebSocket Message Types (client -> server):**\n")
+    client_types = [t for t in ws_types_sorted
+                    if any(s.get("id") for s in ws_message_types[t]["samples"])]
+    for msg_type in client_types:
+        w(f"  - {msg_type}\n")
+    w("\n")
 
-    output_lines.append("**WebSocket Message Types (server -> client):**")
+    w("**WebSocket Message Types (server -> client):**\n")
     server_types = ["result", "event", "auth_required", "auth_ok", "pong"]
-    for msg_type in sorted(ws_message_types.keys()):
+    for msg_type in ws_types_sorted:
         if msg_type in server_types:
-            output_lines.append(f"  - {msg_type}")
+            w(f"  - {msg_type}\n")
 
     # Write output
-    output_content = "\n".join(output_lines)
     output_path.parent.mkdir(parents=True, exist_ok=True)
     with open(output_path, "w") as f:
-        f.write(output_content)
+        f.write(buf.getvalue())
 
     print(f"Output written to: {output_path}")
     print(f"\nQuick Summary:")